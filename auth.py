@@ -1,9 +1,15 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy.orm import Session
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
+from cachetools import TTLCache
+import bcrypt
 import hashlib
+import threading
+import time
 import os
+from models import get_db, User
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
@@ -11,15 +17,36 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30000
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login")
 
+# Cache of already-validated tokens so we don't re-run jwt.decode on every request.
+# Keyed by a hash of the token, value is (email, exp). Invalid tokens are never cached.
+TOKEN_CACHE_TTL = 30
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+# Successful password checks, so repeated logins with the same credential skip bcrypt.
+# Only True results are stored so the cache can't be used as an oracle.
+_PW_CACHE = TTLCache(maxsize=1024, ttl=60)
+_PW_CACHE_LOCK = threading.Lock()
+
 def verify_password(plain_password, hashed_password):
-    # Simple SHA-256 hashing for demo purposes
-    # In production, use proper bcrypt
-    return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+    key = hashlib.blake2b(plain_password.encode() + hashed_password.encode(), digest_size=16).digest()
+    with _PW_CACHE_LOCK:
+        if key in _PW_CACHE:
+            return True
+
+    if hashed_password.startswith("$2"):
+        valid = bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    else:
+        # Accounts created before the bcrypt switch still have a bare SHA-256 hash
+        valid = hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+
+    if valid:
+        with _PW_CACHE_LOCK:
+            _PW_CACHE[key] = True
+    return valid
 
 def get_password_hash(password):
-    # Simple SHA-256 hashing for demo purposes
-    # In production, use proper bcrypt
-    return hashlib.sha256(password.encode()).hexdigest()
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -27,12 +54,41 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def _get_cached_token(key):
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(key)
+    if entry is None:
+        return None
+    email, exp = entry
+    # Don't serve a token from cache past its own expiry
+    if exp is not None and exp <= time.time():
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE.pop(key, None)
+        return None
+    return email
+
 def verify_token(token: str = Depends(oauth2_scheme)):
+    key = hashlib.sha256(token.encode()).digest()
+    email = _get_cached_token(key)
+    if email is not None:
+        return email
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        return email
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[key] = (email, payload.get("exp"))
+    return email
+
+def get_current_user_obj(email: str = Depends(verify_token), db: Session = Depends(get_db)):
+    # FastAPI caches dependencies per request, so this runs at most once and
+    # shares the handler's session
+    user = db.query(User).filter(User.email == email).first()
+    if not user:
+        raise HTTPException(404, "User not found")
+    return user
\ No newline at end of file
@@ -1,31 +1,100 @@
 import anthropic
-import base64
+import asyncio
+import copy
+import hashlib
+import httpx
 import json
 from pathlib import Path
-import pdfplumber
+import pybase64
+import pypdfium2 as pdfium
 import os
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Shared HTTP/2 connection pool so connections to the API stay warm and
+# concurrent/batch calls are multiplexed instead of re-handshaking TLS
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=120.0),
+    timeout=30.0,
+)
+
 # Initialize Claude client
-client = anthropic.Anthropic(
-    api_key=os.getenv("ANTHROPIC_API_KEY")
+client = anthropic.AsyncAnthropic(
+    api_key=os.getenv("ANTHROPIC_API_KEY"),
+    http_client=_http_client
 )
 
 # Test mode flag - set to True to use mock data while setting up Claude billing
 TEST_MODE = os.getenv("CLAUDE_TEST_MODE", "false").lower() == "true"
 
+CLAUDE_MODEL = "claude-3-haiku-20240307"
+CLAUDE_MAX_TOKENS = 1000
+
+# Categories Claude may return; anything else is stored as 'other'
+CATEGORIES = ('technology', 'business', 'financial', 'electronics', 'groceries', 'restaurant', 'fuel',
+              'retail', 'pharmacy', 'transportation', 'utilities', 'education', 'other')
+
+# Prompts are built once at import; only the PDF text is filled in per request
+_FIELDS_PROMPT = """Extract:
+- vendor: company/business name
+- amount: total amount due (number only, no currency symbol)
+- date: transaction date in YYYY-MM-DD format if possible, otherwise as written
+- category: one of [""" + ", ".join(CATEGORIES) + """]
+
+Return only valid JSON in this format:
+{
+    "vendor": "Company Name",
+    "amount": 12.34,
+    "date": "2025-10-14",
+    "category": "technology"
+}"""
+
+_PDF_PROMPT_TEMPLATE = """Please extract the following information from this receipt/invoice text and return it as valid JSON:
+
+Text: {text}
+
+""" + _FIELDS_PROMPT.replace("{", "{{").replace("}", "}}")
+
+_IMAGE_PROMPT = """Please extract the following information from this receipt/invoice image and return it as valid JSON:
+
+""" + _FIELDS_PROMPT
+
+_IMAGE_PROMPT_BLOCK = {"type": "text", "text": _IMAGE_PROMPT}
+
+# Reused for locating the JSON object inside Claude's reply
+_JSON_DECODER = json.JSONDecoder()
+
+# Successful results keyed by file content hash, so re-processing the same
+# receipt (retries, double clicks) doesn't make another API call
+_CLAUDE_CACHE = TTLCache(maxsize=4096, ttl=3600)
+HASH_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Transient API errors while checking on a batch are retried this many times
+BATCH_FETCH_RETRIES = 3
+_RETRYABLE_ERRORS = (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)
+
 def convert_pdf_to_image(pdf_path):
     """Convert first page of PDF to image for Claude processing"""
     try:
         # For now, we'll extract text from PDF and process it as text
         # In production, you'd want to convert PDF to image
-        with pdfplumber.open(pdf_path) as pdf:
-            if pdf.pages:
-                return pdf.pages[0].extract_text()
-        return None
+        # pdfium loads pages lazily, so only the first page is parsed
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            if len(pdf) == 0:
+                return None
+            page = pdf[0]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+            return text
+        finally:
+            pdf.close()
     except Exception as e:
         print(f"Error converting PDF: {e}")
         return None
@@ -33,23 +102,43 @@ def convert_pdf_to_image(pdf_path):
 def encode_image(image_path):
     """Encode image to base64 for Claude API"""
     try:
+        # pybase64 uses SIMD encoding and returns str directly (no extra .decode() copy)
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return pybase64.b64encode_as_string(image_file.read())
     except Exception as e:
         print(f"Error encoding image: {e}")
         return None
 
+# extension -> (file type, media type sent to Claude)
+_EXT_MAP = {
+    '.pdf': ('pdf', None),
+    '.jpg': ('image', 'image/jpeg'),
+    '.jpeg': ('image', 'image/jpeg'),
+    '.png': ('image', 'image/png'),
+}
+
+def hash_file(file_path):
+    """blake2b hex digest of a file, same format as Receipt.content_hash"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _get_cached_result(content_hash):
+    result = _CLAUDE_CACHE.get(content_hash)
+    return copy.deepcopy(result) if result is not None else None
+
+def _cache_result(content_hash, result):
+    if result['success']:
+        _CLAUDE_CACHE[content_hash] = copy.deepcopy(result)
+
+def _lookup_extension(file_path):
+    return _EXT_MAP.get(os.path.splitext(file_path)[1].lower(), ('unknown', None))
+
 def get_file_type(file_path):
     """Determine if file is image or PDF"""
-    file_path = Path(file_path)
-    extension = file_path.suffix.lower()
-    
-    if extension == '.pdf':
-        return 'pdf'
-    elif extension in ['.jpg', '.jpeg', '.png']:
-        return 'image'
-    else:
-        return 'unknown'
+    return _lookup_extension(file_path)[0]
 
 def create_mock_response(file_path):
     """Create mock response for testing without Claude API calls"""
@@ -90,111 +179,18 @@ def create_mock_response(file_path):
             'error': None
         }
 
-def process_receipt_with_claude(file_path):
-    """Process receipt using Claude API"""
-    try:
-        # If in test mode, return mock data
-        if TEST_MODE:
-            return create_mock_response(file_path)
-        file_type = get_file_type(file_path)
-        
-        if file_type == 'pdf':
-            # For PDFs, extract text and send to Claude
-            text_content = convert_pdf_to_image(file_path)
-            if not text_content:
-                return {
-                    'vendor': None,
-                    'amount': None,
-                    'date': None,
-                    'category': 'other',
-                    'line_items': [],
-                    'raw_text': '',
-                    'success': False,
-                    'error': 'Could not extract text from PDF'
-                }
-            
-            # Send text to Claude for processing
-            message = client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=1000,
-                messages=[{
-                    "role": "user",
-                    "content": f"""Please extract the following information from this receipt/invoice text and return it as valid JSON:
-
-Text: {text_content}
-
-Extract:
-- vendor: company/business name
-- amount: total amount due (number only, no currency symbol)
-- date: transaction date in YYYY-MM-DD format if possible, otherwise as written
-- category: one of [technology, business, financial, electronics, groceries, restaurant, fuel, retail, pharmacy, transportation, utilities, education, other]
+def build_message_params(file_path):
+    """Build the messages.create parameters for a receipt file.
 
-Return only valid JSON in this format:
-{{
-    "vendor": "Company Name",
-    "amount": 12.34,
-    "date": "2025-10-14",
-    "category": "technology"
-}}"""
-                }]
-            )
-            
-        elif file_type == 'image':
-            # For images, encode and send to Claude
-            image_data = encode_image(file_path)
-            if not image_data:
-                return {
-                    'vendor': None,
-                    'amount': None,
-                    'date': None,
-                    'category': 'other',
-                    'line_items': [],
-                    'raw_text': '',
-                    'success': False,
-                    'error': 'Could not encode image'
-                }
-            
-            # Determine image format
-            file_extension = Path(file_path).suffix.lower()
-            media_type = f"image/{'jpeg' if file_extension in ['.jpg', '.jpeg'] else 'png'}"
-            
-            message = client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=1000,
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_data
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": """Please extract the following information from this receipt/invoice image and return it as valid JSON:
-
-Extract:
-- vendor: company/business name
-- amount: total amount due (number only, no currency symbol)
-- date: transaction date in YYYY-MM-DD format if possible, otherwise as written
-- category: one of [technology, business, financial, electronics, groceries, restaurant, fuel, retail, pharmacy, transportation, utilities, education, other]
-
-Return only valid JSON in this format:
-{
-    "vendor": "Company Name",
-    "amount": 12.34,
-    "date": "2025-10-14",
-    "category": "technology"
-}"""
-                        }
-                    ]
-                }]
-            )
-        else:
-            return {
+    Returns (params, None) on success or (None, error_result) if the file can't be prepared.
+    """
+    file_type, media_type = _lookup_extension(file_path)
+    
+    if file_type == 'pdf':
+        # For PDFs, extract text and send to Claude
+        text_content = convert_pdf_to_image(file_path)
+        if not text_content:
+            return None, {
                 'vendor': None,
                 'amount': None,
                 'date': None,
@@ -202,42 +198,107 @@ Return only valid JSON in this format:
                 'line_items': [],
                 'raw_text': '',
                 'success': False,
-                'error': 'Unsupported file type'
+                'error': 'Could not extract text from PDF'
             }
         
-        # Parse Claude's response
-        response_text = message.content[0].text.strip()
-        
-        # Extract JSON from response (Claude might include extra text)
-        start_idx = response_text.find('{')
-        end_idx = response_text.rfind('}') + 1
+        # Send text to Claude for processing
+        return {
+            "model": CLAUDE_MODEL,
+            "max_tokens": CLAUDE_MAX_TOKENS,
+            "messages": [{
+                "role": "user",
+                "content": _PDF_PROMPT_TEMPLATE.format_map({"text": text_content})
+            }]
+        }, None
         
-        if start_idx == -1 or end_idx == 0:
-            return {
+    elif file_type == 'image':
+        # For images, encode and send to Claude
+        image_data = encode_image(file_path)
+        if not image_data:
+            return None, {
                 'vendor': None,
                 'amount': None,
                 'date': None,
                 'category': 'other',
                 'line_items': [],
-                'raw_text': response_text,
+                'raw_text': '',
                 'success': False,
-                'error': 'Could not parse Claude response'
+                'error': 'Could not encode image'
             }
         
-        json_str = response_text[start_idx:end_idx]
-        parsed_data = json.loads(json_str)
-        
         return {
-            'vendor': parsed_data.get('vendor'),
-            'amount': parsed_data.get('amount'),
-            'date': parsed_data.get('date'),
-            'category': parsed_data.get('category', 'other'),
-            'line_items': [],  # We'll keep this simple for now
+            "model": CLAUDE_MODEL,
+            "max_tokens": CLAUDE_MAX_TOKENS,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": media_type,
+                            "data": image_data
+                        }
+                    },
+                    _IMAGE_PROMPT_BLOCK
+                ]
+            }]
+        }, None
+    else:
+        return None, {
+            'vendor': None,
+            'amount': None,
+            'date': None,
+            'category': 'other',
+            'line_items': [],
+            'raw_text': '',
+            'success': False,
+            'error': 'Unsupported file type'
+        }
+
+def _coerce_amount(value):
+    """Claude's amount as a float, or None if it isn't a number (e.g. "N/A")"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().lstrip('$₦£€').replace(',', ''))
+        except ValueError:
+            return None
+    return None
+
+def _coerce_category(value):
+    """Claude's category if it's one we asked for, otherwise 'other'"""
+    if isinstance(value, str) and value.strip().lower() in CATEGORIES:
+        return value.strip().lower()
+    return 'other'
+
+def parse_claude_response(message):
+    """Turn a Claude message into our receipt result dict"""
+    # Parse Claude's response
+    response_text = message.content[0].text.strip()
+    
+    # Extract JSON from response (Claude might include extra text)
+    start_idx = response_text.find('{')
+    
+    if start_idx == -1:
+        return {
+            'vendor': None,
+            'amount': None,
+            'date': None,
+            'category': 'other',
+            'line_items': [],
             'raw_text': response_text,
-            'success': True,
-            'error': None
+            'success': False,
+            'error': 'Could not parse Claude response'
         }
-        
+    
+    # raw_decode stops at the end of the JSON object, so there's no need to
+    # rfind the closing brace or slice out a copy of the object first
+    try:
+        parsed_data, _ = _JSON_DECODER.raw_decode(response_text, start_idx)
     except json.JSONDecodeError as e:
         return {
             'vendor': None,
@@ -245,10 +306,48 @@ Return only valid JSON in this format:
             'date': None,
             'category': 'other',
             'line_items': [],
-            'raw_text': response_text if 'response_text' in locals() else '',
+            'raw_text': response_text,
             'success': False,
             'error': f'JSON parsing error: {str(e)}'
         }
+    
+    return {
+        'vendor': parsed_data.get('vendor'),
+        'amount': _coerce_amount(parsed_data.get('amount')),
+        'date': parsed_data.get('date'),
+        'category': _coerce_category(parsed_data.get('category')),
+        'line_items': [],  # We'll keep this simple for now
+        'raw_text': response_text,
+        'success': True,
+        'error': None
+    }
+
+async def process_receipt_with_claude(file_path, content_hash=None):
+    """Process receipt using Claude API
+
+    Pass content_hash (e.g. Receipt.content_hash) to skip re-hashing the file.
+    """
+    try:
+        # If in test mode, return mock data
+        if TEST_MODE:
+            return create_mock_response(file_path)
+        
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(hash_file, file_path)
+        cached = _get_cached_result(content_hash)
+        if cached is not None:
+            return cached
+        
+        # Reading/encoding the file is blocking, do it in a worker thread
+        params, error_result = await asyncio.to_thread(build_message_params, file_path)
+        if error_result:
+            return error_result
+        
+        message = await client.messages.create(**params)
+        result = parse_claude_response(message)
+        _cache_result(content_hash, result)
+        return result
+        
     except Exception as e:
         return {
             'vendor': None,
@@ -261,7 +360,112 @@ Return only valid JSON in this format:
             'error': f'Claude API error: {str(e)}'
         }
 
+async def submit_receipts_batch(file_paths, custom_ids, content_hashes=None):
+    """Submit several receipts as one Message Batches request without waiting for it.
+
+    Returns (batch_id, results): results maps custom_id to the result dict for
+    receipts settled right away (cache hits, unreadable files, test mode).
+    batch_id is None when nothing had to be sent.
+    """
+    if TEST_MODE:
+        return None, {custom_id: create_mock_response(file_path) for file_path, custom_id in zip(file_paths, custom_ids)}
+    
+    if content_hashes is None:
+        content_hashes = [None] * len(file_paths)
+    
+    results = {}
+    requests = []
+    for file_path, custom_id, content_hash in zip(file_paths, custom_ids, content_hashes):
+        # One unreadable file shouldn't fail the rest of the batch
+        try:
+            content_hash = content_hash or await asyncio.to_thread(hash_file, file_path)
+            cached = _get_cached_result(content_hash)
+            if cached is not None:
+                results[custom_id] = cached
+                continue
+            
+            params, error_result = await asyncio.to_thread(build_message_params, file_path)
+        except Exception as e:
+            results[custom_id] = {
+                'vendor': None,
+                'amount': None,
+                'date': None,
+                'category': 'other',
+                'line_items': [],
+                'raw_text': '',
+                'success': False,
+                'error': f'Could not read receipt file: {str(e)}'
+            }
+            continue
+        
+        if error_result:
+            results[custom_id] = error_result
+        else:
+            requests.append({"custom_id": custom_id, "params": params})
+    
+    if not requests:
+        return None, results
+    
+    try:
+        batch = await client.messages.batches.create(requests=requests)
+    except Exception as e:
+        for request in requests:
+            results[request["custom_id"]] = {
+                'vendor': None,
+                'amount': None,
+                'date': None,
+                'category': 'other',
+                'line_items': [],
+                'raw_text': '',
+                'success': False,
+                'error': f'Claude API error: {str(e)}'
+            }
+        return None, results
+    
+    return batch.id, results
+
+async def _fetch_batch_results_once(batch_id, content_hashes):
+    batch = await client.messages.batches.retrieve(batch_id)
+    if batch.processing_status != "ended":
+        return batch.processing_status, None
+    
+    results = {}
+    async for entry in await client.messages.batches.results(batch_id):
+        if entry.result.type == "succeeded":
+            results[entry.custom_id] = parse_claude_response(entry.result.message)
+            if content_hashes.get(entry.custom_id):
+                _cache_result(content_hashes[entry.custom_id], results[entry.custom_id])
+        else:
+            results[entry.custom_id] = {
+                'vendor': None,
+                'amount': None,
+                'date': None,
+                'category': 'other',
+                'line_items': [],
+                'raw_text': '',
+                'success': False,
+                'error': f'Claude batch request {entry.result.type}'
+            }
+    return batch.processing_status, results
+
+async def fetch_batch_results(batch_id, content_hashes=None, retries=BATCH_FETCH_RETRIES):
+    """Return (processing_status, results) for a submitted batch.
+
+    results maps custom_id to a result dict once the batch has ended, and is None
+    before that. content_hashes maps custom_id to the file hash so successful
+    results are cached. Connection, rate limit and server errors are retried
+    (including ones halfway through reading the results); others are raised.
+    """
+    content_hashes = content_hashes or {}
+    for attempt in range(retries + 1):
+        try:
+            return await _fetch_batch_results_once(batch_id, content_hashes)
+        except _RETRYABLE_ERRORS:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
 # For backward compatibility, keep the same function name
-def process_receipt(image_path):
+async def process_receipt(image_path, content_hash=None):
     """Process receipt using Claude API (replaces OCR)"""
-    return process_receipt_with_claude(image_path)
\ No newline at end of file
+    return await process_receipt_with_claude(image_path, content_hash)
\ No newline at end of file
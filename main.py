@@ -1,22 +1,48 @@
 from fastapi import FastAPI, Depends, HTTPException, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session, joinedload
+from fastapi.concurrency import run_in_threadpool
+from anyio import from_thread
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
 from pydantic import BaseModel
+from typing import Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
 from models import get_db, User, Receipt, LineItem, create_tables
-from auth import create_access_token, verify_token, get_password_hash, verify_password
-from simple_ocr import process_receipt
-import shutil
+from auth import create_access_token, verify_token, get_current_user_obj, get_password_hash, verify_password
+from simple_ocr import process_receipt, process_receipts
+from ocr_utils import shutdown_workers
+from claude_processor import process_receipt_with_claude, submit_receipts_batch, fetch_batch_results
+import aiofiles
+import hashlib
+import os
 from pathlib import Path
+from uuid import uuid4
 
-app = FastAPI(title="Receipt Tracker API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables once the server starts rather than on import
+    create_tables()
+    yield
+    shutdown_workers()
 
-# Create database tables
-create_tables()
+app = FastAPI(title="Receipt Tracker API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Create upload directory
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+MAX_RECEIPTS_PER_USER = 10
+
+# Extractor used by both /process and /process_batch: "ocr" (local Tesseract) or "claude"
+RECEIPT_ENGINE = os.getenv("RECEIPT_ENGINE", "ocr").lower()
+
+ALLOWED_CONTENT_TYPES = frozenset({"image/jpeg", "image/png", "image/jpg", "application/pdf"})
+ALLOWED_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".pdf"})
+# Extension for stored files when the client's filename doesn't have an allowed one
+CONTENT_TYPE_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/jpg": ".jpg", "application/pdf": ".pdf"}
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +56,75 @@ class UserCreate(BaseModel):
     email: str
     password: str
 
+class BatchProcessRequest(BaseModel):
+    receipt_ids: list[int]
+
+class ReceiptUpdate(BaseModel):
+    vendor: Optional[str]
+    amount: Optional[float]
+    date: Optional[str]
+    category: Optional[str]
+
+class LineItemOut(BaseModel):
+    id: int
+    receipt_id: int
+    name: str
+    quantity: int
+    unit_price: Optional[float]
+    total_price: float
+
+    class Config:
+        orm_mode = True
+
+class ReceiptOut(BaseModel):
+    id: int
+    user_id: int
+    filename: str
+    vendor: Optional[str]
+    amount: Optional[float]
+    date: Optional[str]
+    category: Optional[str]
+    raw_text: Optional[str]
+    created_at: Optional[datetime]
+    line_items: list[LineItemOut]
+
+    class Config:
+        orm_mode = True
+
+def apply_ocr_data(db: Session, receipt: Receipt, ocr_data: dict):
+    """Copy extracted fields and line items onto a receipt (caller commits)"""
+    receipt.vendor = ocr_data['vendor']
+    receipt.amount = ocr_data['amount']
+    receipt.date = ocr_data['date']
+    receipt.category = ocr_data['category']
+    receipt.raw_text = ocr_data['raw_text']
+    # Fresh results win over a Claude batch the receipt may still be waiting on
+    receipt.batch_id = None
+    
+    # Clear existing line items (keep simple for now)
+    db.query(LineItem).filter(LineItem.receipt_id == receipt.id).delete(synchronize_session=False)
+    db.expire(receipt, ['line_items'])
+    
+    # Add line items if any (OCR processor returns empty list for now)
+    line_items = ocr_data.get('line_items', [])
+    if line_items:
+        db.bulk_insert_mappings(LineItem, [
+            {
+                'receipt_id': receipt.id,
+                'name': item_data['name'],
+                'quantity': item_data['quantity'],
+                'unit_price': item_data['unit_price'],
+                'total_price': item_data['total_price']
+            }
+            for item_data in line_items
+        ])
+
+def extract_receipt(receipt: Receipt):
+    """Run the configured extractor on a receipt file (called from a threadpool worker)"""
+    if RECEIPT_ENGINE == "claude":
+        return from_thread.run(process_receipt_with_claude, receipt.filename, receipt.content_hash)
+    return process_receipt(receipt.filename)
+
 @app.get("/")
 def read_root():
     return {"message": "Receipt Tracker API"}
@@ -61,101 +156,108 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 def get_current_user(current_user: str = Depends(verify_token)):
     return {"email": current_user}
 
+def register_upload(db: Session, user_id: int, part_path: Path, content_hash: str, stored_extension: str, filename: str):
+    """Turn a fully written upload into a receipt, or return the user's existing one for the same file"""
+    # Same file uploaded again by this user, return the existing receipt (even at the limit)
+    existing = db.query(Receipt).filter(Receipt.content_hash == content_hash, Receipt.user_id == user_id).first()
+    if existing is not None:
+        return {"id": existing.id, "filename": Path(existing.filename).name}
+    
+    # Check rate limit: maximum 10 receipts per user (increased for local testing)
+    # Probe for the Nth receipt instead of counting them all
+    limit_reached = db.query(Receipt.id).filter(Receipt.user_id == user_id).order_by(Receipt.id).offset(MAX_RECEIPTS_PER_USER - 1).limit(1).scalar() is not None
+    if limit_reached:
+        raise HTTPException(429, "Maximum of 10 receipts per user allowed. Please delete some receipts to upload new ones.")
+    
+    # Stored files are named by content, so a later upload with the same client
+    # filename can't overwrite this receipt's file
+    file_path = UPLOAD_DIR / f"{user_id}_{content_hash}{stored_extension}"
+    os.replace(part_path, file_path)
+    
+    # Create receipt record
+    receipt = Receipt(user_id=user_id, filename=str(file_path), content_hash=content_hash)
+    db.add(receipt)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent upload of the same file won the unique (content_hash, user_id) index
+        db.rollback()
+        existing = db.query(Receipt).filter(Receipt.content_hash == content_hash, Receipt.user_id == user_id).first()
+        if existing is None:
+            raise
+        # Only that receipt could share this path (same user and contents)
+        if existing.filename != str(file_path):
+            file_path.unlink(missing_ok=True)
+        return {"id": existing.id, "filename": Path(existing.filename).name}
+    
+    return {"id": receipt.id, "filename": filename}
+
 @app.post("/api/receipts/upload")
 async def upload_receipt(
     file: UploadFile = File(...),
-    current_user: str = Depends(verify_token),
+    user: User = Depends(get_current_user_obj),
     db: Session = Depends(get_db)
 ):
     # Validate file type - check content type OR file extension
-    allowed_content_types = ["image/jpeg", "image/png", "image/jpg", "application/pdf"]
-    allowed_extensions = [".jpg", ".jpeg", ".png", ".pdf"]
-    
-    file_extension = Path(file.filename).suffix.lower()
+    dot = file.filename.rfind('.')
+    file_extension = file.filename[dot:].lower() if dot != -1 else ''
     
     # Allow file if either content type OR extension is valid
-    valid_content_type = file.content_type in allowed_content_types
-    valid_extension = file_extension in allowed_extensions
-    
-    if not (valid_content_type or valid_extension):
+    if file.content_type not in ALLOWED_CONTENT_TYPES and file_extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(400, "Only JPEG/PNG images and PDF files allowed")
     
-    # Get user
-    user = db.query(User).filter(User.email == current_user).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    
-    # Check rate limit: maximum 10 receipts per user (increased for local testing)
-    receipt_count = db.query(Receipt).filter(Receipt.user_id == user.id).count()
-    if receipt_count >= 10:
-        raise HTTPException(429, "Maximum of 10 receipts per user allowed. Please delete some receipts to upload new ones.")
+    # Write to a temporary name first so nothing is left behind if the upload is a duplicate or over the limit
+    part_path = UPLOAD_DIR / f"{user.id}_{uuid4().hex}.part"
     
-    # Save file
-    file_path = UPLOAD_DIR / f"{user.id}_{file.filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Create receipt record
-    receipt = Receipt(user_id=user.id, filename=str(file_path))
-    db.add(receipt)
-    db.commit()
-    db.refresh(receipt)
-    
-    return {"id": receipt.id, "filename": file.filename}
+    try:
+        # Hash while writing so duplicates can be detected without re-reading the file
+        digest = hashlib.blake2b(digest_size=16)
+        async with aiofiles.open(part_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                await buffer.write(chunk)
+        content_hash = digest.hexdigest()
+        
+        stored_extension = file_extension if file_extension in ALLOWED_EXTENSIONS else CONTENT_TYPE_EXTENSIONS[file.content_type]
+        # Database work is blocking, keep it off the event loop
+        return await run_in_threadpool(register_upload, db, user.id, part_path, content_hash, stored_extension, file.filename)
+    finally:
+        part_path.unlink(missing_ok=True)
 
-@app.get("/api/receipts")
+@app.get("/api/receipts", response_model=list[ReceiptOut])
 def list_receipts(current_user: str = Depends(verify_token), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == current_user).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    
-    receipts = db.query(Receipt).options(joinedload(Receipt.line_items)).filter(Receipt.user_id == user.id).all()
+    # selectinload fetches all line items in one extra query without repeating receipt rows
+    receipts = db.query(Receipt).join(User).options(selectinload(Receipt.line_items)).filter(User.email == current_user).all()
     return receipts
 
-@app.get("/api/receipts/{receipt_id}")
+@app.get("/api/receipts/{receipt_id}", response_model=ReceiptOut)
 def get_receipt(receipt_id: int, current_user: str = Depends(verify_token), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == current_user).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    
-    receipt = db.query(Receipt).options(joinedload(Receipt.line_items)).filter(Receipt.id == receipt_id, Receipt.user_id == user.id).first()
+    receipt = db.query(Receipt).join(User).options(joinedload(Receipt.line_items)).filter(Receipt.id == receipt_id, User.email == current_user).first()
     if not receipt:
         raise HTTPException(404, "Receipt not found")
     return receipt
 
-@app.put("/api/receipts/{receipt_id}")
+@app.put("/api/receipts/{receipt_id}", response_model=ReceiptOut)
 def update_receipt(
     receipt_id: int,
-    data: dict,
+    data: ReceiptUpdate,
     current_user: str = Depends(verify_token),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.email == current_user).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    
-    receipt = db.query(Receipt).filter(Receipt.id == receipt_id, Receipt.user_id == user.id).first()
+    receipt = db.query(Receipt).join(User).options(selectinload(Receipt.line_items)).filter(Receipt.id == receipt_id, User.email == current_user).first()
     if not receipt:
         raise HTTPException(404, "Receipt not found")
     
-    # Update receipt fields
-    allowed_fields = ['vendor', 'amount', 'date', 'category']
-    for key, value in data.items():
-        if key in allowed_fields:
-            setattr(receipt, key, value)
+    # Update only the fields that were sent (already coerced, e.g. amount to float)
+    for key, value in data.dict(exclude_unset=True).items():
+        setattr(receipt, key, value)
     
     db.commit()
-    db.refresh(receipt)
     return receipt
 
 @app.delete("/api/receipts/{receipt_id}")
 def delete_receipt(receipt_id: int, current_user: str = Depends(verify_token), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == current_user).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    
-    receipt = db.query(Receipt).filter(Receipt.id == receipt_id, Receipt.user_id == user.id).first()
+    receipt = db.query(Receipt).join(User).filter(Receipt.id == receipt_id, User.email == current_user).first()
     if not receipt:
         raise HTTPException(404, "Receipt not found")
     
@@ -173,13 +275,8 @@ def delete_receipt(receipt_id: int, current_user: str = Depends(verify_token), d
 
 @app.post("/api/receipts/{receipt_id}/process")
 def process_receipt_ocr(receipt_id: int, current_user: str = Depends(verify_token), db: Session = Depends(get_db)):
-    # Get user
-    user = db.query(User).filter(User.email == current_user).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    
     # Get receipt
-    receipt = db.query(Receipt).filter(Receipt.id == receipt_id, Receipt.user_id == user.id).first()
+    receipt = db.query(Receipt).join(User).filter(Receipt.id == receipt_id, User.email == current_user).first()
     if not receipt:
         raise HTTPException(404, "Receipt not found")
     
@@ -189,35 +286,15 @@ def process_receipt_ocr(receipt_id: int, current_user: str = Depends(verify_toke
     
     # Process receipt with OCR
     try:
-        ocr_data = process_receipt(receipt.filename)
+        ocr_data = extract_receipt(receipt)
         
         if not ocr_data['success']:
             raise HTTPException(500, f"OCR processing failed: {ocr_data['error']}")
         
         # Update receipt with extracted data
-        receipt.vendor = ocr_data['vendor']
-        receipt.amount = ocr_data['amount']
-        receipt.date = ocr_data['date']
-        receipt.category = ocr_data['category']
-        receipt.raw_text = ocr_data['raw_text']
-        
-        # Clear existing line items (keep simple for now)
-        for item in receipt.line_items:
-            db.delete(item)
-        
-        # Add line items if any (OCR processor returns empty list for now)
-        for item_data in ocr_data.get('line_items', []):
-            line_item = LineItem(
-                receipt_id=receipt.id,
-                name=item_data['name'],
-                quantity=item_data['quantity'],
-                unit_price=item_data['unit_price'],
-                total_price=item_data['total_price']
-            )
-            db.add(line_item)
+        apply_ocr_data(db, receipt, ocr_data)
         
         db.commit()
-        db.refresh(receipt)
         
         return {
             "id": receipt.id,
@@ -229,4 +306,117 @@ def process_receipt_ocr(receipt_id: int, current_user: str = Depends(verify_toke
         }
         
     except Exception as e:
-        raise HTTPException(500, f"OCR processing failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(500, f"OCR processing failed: {str(e)}")
+
+def load_batch_receipts(db: Session, receipt_ids: list[int], current_user: str):
+    """Fetch the caller's receipts for a batch, with those still on disk"""
+    receipts = db.query(Receipt).join(User).filter(Receipt.id.in_(receipt_ids), User.email == current_user).all()
+    pending = [receipt for receipt in receipts if Path(receipt.filename).exists()]
+    return receipts, pending
+
+def apply_batch_results(db: Session, receipts: list[Receipt], ocr_by_id: dict):
+    """Apply batch OCR results to receipts in one commit and build the response"""
+    results = []
+    for receipt in receipts:
+        ocr_data = ocr_by_id.get(receipt.id)
+        if ocr_data is None:
+            results.append({"id": receipt.id, "success": False, "error": "Receipt image file not found"})
+            continue
+        
+        if not ocr_data['success']:
+            results.append({"id": receipt.id, "success": False, "error": ocr_data['error']})
+            continue
+        
+        apply_ocr_data(db, receipt, ocr_data)
+        results.append({
+            "id": receipt.id,
+            "vendor": receipt.vendor,
+            "amount": receipt.amount,
+            "date": receipt.date,
+            "category": receipt.category,
+            "success": True
+        })
+    
+    # One commit for the whole batch
+    db.commit()
+    return results
+
+def process_batch_locally(db: Session, receipts: list[Receipt], pending: list[Receipt]):
+    """OCR the pending receipts in the shared worker processes and apply the results"""
+    # OCR is CPU bound, so the receipts run in parallel processes rather than one after another here
+    ocr_results = process_receipts([receipt.filename for receipt in pending])
+    ocr_by_id = dict(zip((receipt.id for receipt in pending), ocr_results))
+    return apply_batch_results(db, receipts, ocr_by_id)
+
+def start_claude_batch(db: Session, settled: list[Receipt], ocr_by_id: dict, submitted: list[Receipt], batch_id: str):
+    """Mark receipts as waiting on a submitted batch and apply the results already known"""
+    for receipt in submitted:
+        receipt.batch_id = batch_id
+    return apply_batch_results(db, settled, ocr_by_id)
+
+def load_batch_waiting(db: Session, batch_id: str, current_user: str):
+    """The caller's receipts still waiting on a Claude batch"""
+    return db.query(Receipt).join(User).filter(Receipt.batch_id == batch_id, User.email == current_user).all()
+
+def finish_claude_batch(db: Session, receipts: list[Receipt], ocr_by_key: dict):
+    """Apply an ended batch's results (keyed by receipt id); failed receipts stop waiting too"""
+    for receipt in receipts:
+        receipt.batch_id = None
+    return apply_batch_results(db, receipts, {int(key): ocr_data for key, ocr_data in ocr_by_key.items()})
+
+@app.post("/api/receipts/process_batch")
+async def process_receipts_batch_ocr(
+    data: BatchProcessRequest,
+    current_user: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    # Database work is blocking, keep it off the event loop
+    receipts, pending = await run_in_threadpool(load_batch_receipts, db, data.receipt_ids, current_user)
+    if not receipts:
+        raise HTTPException(404, "Receipt not found")
+    
+    # Requested ids that aren't the caller's receipts are reported, not dropped
+    found_ids = {receipt.id for receipt in receipts}
+    not_found = [
+        {"id": receipt_id, "success": False, "error": "Receipt not found"}
+        for receipt_id in dict.fromkeys(data.receipt_ids) if receipt_id not in found_ids
+    ]
+    
+    if RECEIPT_ENGINE != "claude":
+        # Local OCR finishes in the request, same extractor as /process
+        results = await run_in_threadpool(process_batch_locally, db, receipts, pending)
+        return {"batch_id": None, "pending": [], "results": results + not_found}
+    
+    # Submit one Message Batch and return straight away; the receipts remember the
+    # batch id and GET /api/receipts/process_batch/{batch_id} applies the results
+    batch_id, ocr_by_key = await submit_receipts_batch(
+        [receipt.filename for receipt in pending],
+        [str(receipt.id) for receipt in pending],
+        [receipt.content_hash for receipt in pending]
+    )
+    submitted = [receipt for receipt in pending if str(receipt.id) not in ocr_by_key]
+    settled = [receipt for receipt in receipts if receipt not in submitted]
+    ocr_by_id = {int(key): ocr_data for key, ocr_data in ocr_by_key.items()}
+    results = await run_in_threadpool(start_claude_batch, db, settled, ocr_by_id, submitted, batch_id)
+    return {"batch_id": batch_id, "pending": [receipt.id for receipt in submitted], "results": results + not_found}
+
+@app.get("/api/receipts/process_batch/{batch_id}")
+async def get_batch_results(batch_id: str, current_user: str = Depends(verify_token), db: Session = Depends(get_db)):
+    # Only batches that still hold some of the caller's receipts can be looked up
+    receipts = await run_in_threadpool(load_batch_waiting, db, batch_id, current_user)
+    if not receipts:
+        raise HTTPException(404, "No receipts are waiting on this batch")
+    
+    try:
+        status, ocr_by_key = await fetch_batch_results(batch_id, {str(receipt.id): receipt.content_hash for receipt in receipts})
+    except Exception as e:
+        raise HTTPException(502, f"Could not fetch batch results: {str(e)}")
+    
+    if ocr_by_key is None:
+        return {"batch_id": batch_id, "status": status, "pending": [receipt.id for receipt in receipts], "results": []}
+    
+    # Requests the batch returned nothing for are reported as failed rather than left waiting
+    for receipt in receipts:
+        ocr_by_key.setdefault(str(receipt.id), {'success': False, 'error': 'Claude batch returned no result'})
+    results = await run_in_threadpool(finish_claude_batch, db, receipts, ocr_by_key)
+    return {"batch_id": batch_id, "status": status, "pending": [], "results": results}
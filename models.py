@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Index, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -6,8 +7,32 @@ import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./receipts.db")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+_url = make_url(DATABASE_URL)
+# In-memory SQLite gets a SingletonThreadPool, which takes no pool sizing
+IS_MEMORY_SQLITE = IS_SQLITE and (_url.database in (None, "", ":memory:") or _url.query.get("mode") == "memory")
+
+# FastAPI runs sync endpoints on a threadpool, size the pool to match
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 30} if IS_SQLITE else {},
+    pool_pre_ping=True,
+    **({} if IS_MEMORY_SQLITE else {"pool_size": 20, "max_overflow": 40}),
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _):
+        # WAL lets readers keep going while an upload is writing
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+
+# Objects stay loaded after commit, so endpoints don't need db.refresh() to read them back
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 class User(Base):
@@ -27,10 +52,19 @@ class Receipt(Base):
     date = Column(String, nullable=True)
     category = Column(String, nullable=True)
     raw_text = Column(Text, nullable=True)  # Use Text for longer content
+    content_hash = Column(String, nullable=True)  # blake2b of the uploaded file, used to spot duplicate uploads
+    batch_id = Column(String, nullable=True)  # Claude Message Batch this receipt is waiting on, if any
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationship to line items
     line_items = relationship("LineItem", back_populates="receipt", cascade="all, delete-orphan")
+    
+    # Per-user listing and the receipt limit check are index lookups.
+    # One receipt per file per user; content_hash leads so duplicate lookups are index seeks.
+    __table_args__ = (
+        Index("ix_receipts_user_id_id", "user_id", "id"),
+        Index("ix_receipts_content_hash_user_id", "content_hash", "user_id", unique=True),
+    )
 
 class LineItem(Base):
     __tablename__ = "line_items"
@@ -52,4 +86,19 @@ def get_db():
         db.close()
 
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    inspector = inspect(engine)
+    if not inspector.has_table("receipts"):
+        Base.metadata.create_all(bind=engine)
+        return
+    
+    # Existing database: create_all would only re-check every table, so just
+    # add receipt columns/indexes introduced after it was created
+    receipt_columns = {column["name"] for column in inspector.get_columns("receipts")}
+    for column in ("content_hash", "batch_id"):
+        if column not in receipt_columns:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE receipts ADD COLUMN {column} VARCHAR"))
+    receipt_indexes = {index["name"] for index in inspector.get_indexes("receipts")}
+    for index in Receipt.__table__.indexes:
+        if index.name not in receipt_indexes:
+            index.create(bind=engine)
\ No newline at end of file
@@ -1,67 +1,188 @@
-import pytesseract
-import cv2
-import re
+import threading
+import regex as re
 import numpy as np
 from datetime import datetime
-from pathlib import Path
-from PIL import Image
-import PyPDF2
-import pdfplumber
 import io
+from ocr_utils import (PDF_MAX_PAGES, PDF_TEXT_TARGET_CHARS, get_file_type, pdfplumber_text,
+                       build_pattern_scanner, candidates, build_automaton, first_label, contains_any,
+                       count_category, split_lines, parse_amount, process_in_workers)
+
+# The OCR/PDF libraries (cv2, pytesseract, tesserocr, PIL, pdfplumber, PyPDF2) are
+# imported where they're first used: a PDF never needs the image stack and vice
+# versa, and each worker process starts without loading all of them
+
+# Regexes are compiled once at import instead of on every call.
+# Uses the `regex` package (VERSION1 semantics) for its possessive quantifiers;
+# its Unicode classes differ slightly from `re`, see ocr_utils.
+_SEARCH_FLAGS = re.IGNORECASE | re.MULTILINE | re.VERSION1
+_MATCH_FLAGS = re.IGNORECASE | re.VERSION1
+
+# Look for company names in typical positions (no ^/$, so no MULTILINE needed).
+# The optional-suffix patterns use a possessive name run (++) so a long line of
+# capitals can't backtrack; the suffix is optional there so the match is the same.
+_VENDOR_RES = tuple(re.compile(p, _MATCH_FLAGS) for p in (
+    r'recipient details\s*([A-Z][A-Z\s&.\-]++(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC)?)',  # After "Recipient Details"
+    r'merchant[:\s]+([A-Z][A-Z\s&.\-]++(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC)?)',       # After "Merchant:"
+    r'payee[:\s]+([A-Z][A-Z\s&.\-]++(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC)?)',         # After "Payee:"
+    r'(?<![A-Z])([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC))',           # Any company name pattern
+    r'(\w+\s+Corporation)',  # "Railway Corporation"
+))
+
+_VENDOR_CLEAN_RE = re.compile(r'[^\w\s&.\-]', re.VERSION1)
+# Same cleanup as a str.translate table for ASCII lines (the usual case). It covers
+# every ASCII code point, which keeps translate on CPython's fast path.
+_VENDOR_CLEAN_TABLE = {i: None if _VENDOR_CLEAN_RE.match(chr(i)) else i for i in range(128)}
+
+# Nigerian amount patterns (₦ Naira) and international formats
+_AMOUNT_RES = tuple(re.compile(p, _SEARCH_FLAGS) for p in (
+    r'₦\s*([0-9,]+\.?\d{0,2})',           # "₦7,000.00" or "₦7,000"
+    r'(?<![0-9,])([0-9,]+\.?\d{0,2})\s*naira',  # "7,000.00 naira"
+    r'total[:\s]*₦?\s*([0-9,]+\.?\d{0,2})',  # "TOTAL: ₦7,000.00"
+    r'amount[:\s]*₦?\s*([0-9,]+\.?\d{0,2})',  # "AMOUNT: ₦7,000.00"
+    r'amount\s+due[:\s]*\$?\s*([0-9,]+\.?\d{0,2})',  # "Amount due: $12.34"
+    r'amount\s+due\s+\$?([0-9,]+\.?\d{0,2})\s*USD',  # "Amount due $12.34 USD"
+    r'\$\s*([0-9,]+\.?\d{0,2})',          # "$12.34" (USD for international invoices)
+    r'(?<![0-9,])([0-9,]+\.?\d{0,2})\s*USD',    # "12.34 USD"
+    r'total[:\s]*\$?\s*([0-9,]+\.?\d{0,2})',  # "TOTAL: $12.34"
+    r'amount[:\s]*\$?\s*([0-9,]+\.?\d{0,2})',  # "AMOUNT: $12.34"
+    r'^([0-9]{1,3}(?:,[0-9]{3})*\.?[0-9]{0,2})$',  # Standalone amounts like "7,000.00" on their own line
+    r'\n([0-9]{1,3}(?:,[0-9]{3})*\.?[0-9]{0,2})\n',  # Amount surrounded by newlines
+))
+
+# Nigerian and international date patterns
+_DATE_RES = tuple(re.compile(p, _MATCH_FLAGS) for p in (
+    r'(Nov\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}\s+\d{1,2}:\d{2}:\d{2})',  # "Nov 7th, 2025 17:53:25"
+    r'(Nov\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})',  # "Nov 7th, 2025"
+    r'(October\s+\d{1,2},?\s+\d{4})',  # "October 14, 2025"
+    r'(November\s+\d{1,2},?\s+\d{4})',  # "November 3, 2025"
+    r'((?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4})',  # Full month names
+    r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',  # 12/31/2024, 12-31-24
+    r'(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4})',  # 31 Dec 2024
+    r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{2,4})',  # December 31, 2024
+    r'(\d{4}-\d{1,2}-\d{1,2})',  # 2024-12-31 (ISO format)
+    r'(\d{2}/\d{2}/\d{4})',  # DD/MM/YYYY
+))
+
+# Patterns for line items (name, quantity, price)
+_LINE_ITEM_RES = tuple(re.compile(p, _MATCH_FLAGS) for p in (
+    # Pattern: "Item Name    Qty    Price" or "Item Name    Pcs    2    800.00"
+    r'^([A-Za-z][A-Za-z\s\.,&-]+?)\s+(Pcs?|REGULAR)\s+(\d+)\s+([0-9,]+\.?\d{0,2})$',
+    # Pattern: "Item Name    Price" (assume quantity = 1)
+    r'^([A-Za-z][A-Za-z\s\.,&-]+?)\s+([0-9,]+\.?\d{0,2})$',
+    # Pattern with different separators
+    r'^([A-Za-z][A-Za-z\s\.,&-]+?)\s+(?:Pcs?|REGULAR|x)?\s*(\d+)?\s*x?\s*([0-9,]+\.?\d{0,2})$'
+))
+
+# Field patterns checked by the Hyperscan prefilter before extraction
+_PREFILTER_RES = _VENDOR_RES + _AMOUNT_RES + _DATE_RES
+_scan_patterns = build_pattern_scanner(_PREFILTER_RES)
+
+# Category keywords, checked in order - the first category with a match wins
+CATEGORY_KEYWORDS = {
+    'financial': ['opay', 'bank', 'transfer', 'payment', 'transaction', 'mobile money', 'fintech'],
+    'electronics': ['electro', 'galactica', 'electronics', 'computer', 'tech', 'gadget'],
+    'technology': ['hosting', 'domain', 'server', 'cloud', 'software', 'saas', 'railway', 'vercel', 'netlify', 'aws', 'invoice'],
+    'business': ['company ltd', 'limited', 'corporation', 'enterprise', 'services', 'consultant'],
+    'groceries': ['grocery', 'supermarket', 'food', 'market', 'shoprite', 'spar', 'provision'],
+    'restaurant': ['restaurant', 'cafe', 'pizza', 'dining', 'bar', 'grill', 'kitchen', 'eatery'],
+    'fuel': ['gas', 'fuel', 'petrol', 'filling station', 'total', 'mobil', 'oando'],
+    'retail': ['store', 'shop', 'mall', 'boutique', 'clothing', 'fashion'],
+    'pharmacy': ['pharmacy', 'medical', 'drug', 'health', 'hospital', 'clinic'],
+    'transportation': ['uber', 'bolt', 'taxi', 'bus', 'transport', 'travel'],
+    'utilities': ['electric', 'water', 'nepa', 'internet', 'phone', 'utility', 'telecom', 'mtn', 'airtel'],
+    'education': ['school', 'university', 'education', 'training', 'course'],
+}
+
+_CATEGORY_NAMES = list(CATEGORY_KEYWORDS)
+_CATEGORY_AUTOMATON = build_automaton(CATEGORY_KEYWORDS)
+
+# Lines to skip when looking for vendor names / line items
+_VENDOR_SKIP_AUTOMATON = build_automaton({'skip': ['transaction', 'receipt', 'successful', '@', 'nov ', 'session', 'enjoy', 'invoice number', 'date of issue']})
+_FIRST_LINE_SKIP_AUTOMATON = build_automaton({'skip': ['@', 'transaction', 'receipt', 'invoice']})
+_LINE_ITEM_SKIP_AUTOMATON = build_automaton({'skip': ['item name', 'subtotal', 'total', 'discount', 'settled', 'thank you', 'receipt', '====']})
+
+# Words near an amount that mark it as the final total ('amount due' is covered by 'due')
+_AMOUNT_CONTEXT_AUTOMATON = build_automaton({'context': ['total', 'due', 'pay']})
 
 def preprocess_image(image_path):
     """Basic image preprocessing for OCR"""
-    # Read image
-    img = cv2.imread(str(image_path))
+    import cv2
 
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Read image straight into grayscale (no separate BGR copy + cvtColor pass)
+    gray = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
 
     # Apply OTSU thresholding for better text extraction
     _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
-    # Optional: Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(thresh, (1, 1), 0)
+    return thresh
+
+# In-process Tesseract, created on first use so the language model loads once per
+# process instead of once per pytesseract subprocess. One API object can only run
+# one image at a time, hence the lock.
+_TESS_API = None
+_TESS_API_FAILED = False
+_TESS_LOCK = threading.Lock()
+
+def _get_tess_api():
+    global _TESS_API, _TESS_API_FAILED
+    if _TESS_API is None and not _TESS_API_FAILED:
+        try:
+            from tesserocr import PyTessBaseAPI, PSM, OEM
+            _TESS_API = PyTessBaseAPI(psm=PSM.SINGLE_BLOCK, oem=OEM.LSTM_ONLY)
+        except ImportError:  # built against libtesseract; without it OCR goes through pytesseract
+            _TESS_API_FAILED = True
+        except RuntimeError as e:  # e.g. no tessdata where libtesseract expects it
+            print(f"tesserocr unavailable, falling back to pytesseract: {e}")
+            _TESS_API_FAILED = True
+    return _TESS_API
+
+def ocr_image(processed):
+    """Run Tesseract on a preprocessed (grayscale numpy) image"""
+    from PIL import Image
+
+    image = Image.fromarray(processed)
+    with _TESS_LOCK:
+        api = _get_tess_api()
+        if api is not None:
+            api.SetImage(image)
+            return api.GetUTF8Text()
 
-    return blurred
+    import pytesseract
+
+    # pytesseract always writes a temp image for the tesseract binary; tag
+    # it as BMP so that write is a raw dump rather than a PNG compression pass
+    image.format = 'BMP'
+    return pytesseract.image_to_string(image, config='--psm 6 --oem 1')
 
 def extract_text_from_pdf(file_path):
     """Extract text from PDF receipt using pdfplumber"""
     try:
-        text = ""
-
         # Try pdfplumber first (better for structured PDFs)
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        parts, total = pdfplumber_text(file_path)
 
         # If pdfplumber didn't extract much, fallback to PyPDF2
-        if len(text.strip()) < 50:
-            with open(file_path, 'rb') as file:
+        if len("\n".join(parts).strip()) < 50:
+            import PyPDF2
+
+            # 64KB buffer: PyPDF2 seeks and reads in small pieces, so the default 8KB means many more syscalls
+            with open(file_path, 'rb', buffering=64 * 1024) as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
+                for page in pdf_reader.pages[:PDF_MAX_PAGES]:
                     page_text = page.extract_text()
                     if page_text:
-                        text += page_text + "\n"
+                        parts.append(page_text)
+                        total += len(page_text)
+                        if total > PDF_TEXT_TARGET_CHARS:
+                            break
 
-        return text.strip()
+        return "\n".join(parts).strip()
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return ""
 
 def detect_file_type(file_path):
     """Detect if file is PDF or image"""
-    file_path = Path(file_path)
-    extension = file_path.suffix.lower()
-
-    if extension == '.pdf':
-        return 'pdf'
-    elif extension in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp']:
-        return 'image'
-    else:
-        return 'unknown'
+    return get_file_type(file_path)
 
 def extract_text(file_path):
     """Extract text from receipt file (image or PDF)"""
@@ -74,8 +195,7 @@ def extract_text(file_path):
         elif file_type == 'image':
             # Preprocess image and extract text using OCR
             processed = preprocess_image(file_path)
-            text = pytesseract.image_to_string(processed, config='--psm 6')
-            return text
+            return ocr_image(processed)
         else:
             print(f"Unsupported file type: {file_type}")
             return ""
@@ -83,23 +203,23 @@ def extract_text(file_path):
         print(f"Error extracting text: {e}")
         return ""
 
-def extract_vendor(text):
+def _clean_vendor(line):
+    if line.isascii():
+        return line.translate(_VENDOR_CLEAN_TABLE)
+    return _VENDOR_CLEAN_RE.sub('', line)
+
+def extract_vendor(text, hits=None, text_lower=None, lines=None, lines_lower=None):
     """Extract vendor name - improved for Nigerian receipts and international invoices"""
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    
-    # Look for company names in typical positions
-    vendor_patterns = [
-        r'recipient details\s*([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC)?)',  # After "Recipient Details"
-        r'merchant[:\s]+([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC)?)',       # After "Merchant:"
-        r'payee[:\s]+([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC)?)',         # After "Payee:"
-        r'([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|CORPORATION|PLC))',                     # Any company name pattern
-        r'(\w+\s+Corporation)',  # "Railway Corporation"
-    ]
+    if text_lower is None:
+        text_lower = text.lower()
+    if lines is None:
+        lines = split_lines(text)
+    if lines_lower is None:
+        lines_lower = [line.lower() for line in lines]
     
     # First try pattern matching
-    for pattern in vendor_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE)
-        for match in matches:
+    for pattern in candidates(_VENDOR_RES, hits):
+        for match in pattern.finditer(text):
             vendor = match.group(1).strip()
             # Clean up vendor name - remove bank info if included
             vendor = vendor.split('\n')[0].strip()  # Take only first line
@@ -107,58 +227,47 @@ def extract_vendor(text):
                 return vendor
     
     # Check for specific known vendors
-    if 'railway corporation' in text.lower():
+    if 'railway corporation' in text_lower:
         return 'Railway Corporation'
-    if 'electro galactica' in text.lower():
+    if 'electro galactica' in text_lower:
         return 'Electro Galactica Company LTD'
-    if 'opay' in text.lower():
+    if 'opay' in text_lower:
         return 'OPay'
     
     # Fallback: look for lines that look like company names
-    for line in lines:
+    for line, line_lower in zip(lines, lines_lower):
         # Skip obvious non-vendor lines
-        if any(skip in line.lower() for skip in ['transaction', 'receipt', 'successful', '@', 'nov ', 'session', 'enjoy', 'invoice number', 'date of issue']):
+        if contains_any(_VENDOR_SKIP_AUTOMATON, line_lower):
             continue
         
         # Look for lines with mostly uppercase letters (company names)
         if len(line) > 3 and sum(1 for c in line if c.isupper()) > len(line) * 0.6:
-            vendor = re.sub(r'[^\w\s&.-]', '', line)  # Clean special chars
+            vendor = _clean_vendor(line)  # Clean special chars
             return vendor.strip()
     
     # Last resort: first meaningful line
-    for line in lines:
-        if len(line) > 3 and not any(skip in line.lower() for skip in ['@', 'transaction', 'receipt', 'invoice']):
-            vendor = re.sub(r'[^\w\s&.-]', '', line)
+    for line, line_lower in zip(lines, lines_lower):
+        if len(line) > 3 and not contains_any(_FIRST_LINE_SKIP_AUTOMATON, line_lower):
+            vendor = _clean_vendor(line)
             return vendor.strip()
     
     return None
 
-def extract_amount(text):
+def extract_amount(text, hits=None, text_lower=None):
     """Extract total amount using regex patterns - Updated for Nigerian receipts and international invoices"""
-    # Nigerian amount patterns (₦ Naira) and international formats
-    patterns = [
-        r'₦\s*([0-9,]+\.?\d{0,2})',           # "₦7,000.00" or "₦7,000"
-        r'([0-9,]+\.?\d{0,2})\s*naira',       # "7,000.00 naira"
-        r'total[:\s]*₦?\s*([0-9,]+\.?\d{0,2})',  # "TOTAL: ₦7,000.00"
-        r'amount[:\s]*₦?\s*([0-9,]+\.?\d{0,2})',  # "AMOUNT: ₦7,000.00"
-        r'amount\s+due[:\s]*\$?\s*([0-9,]+\.?\d{0,2})',  # "Amount due: $12.34"
-        r'amount\s+due\s+\$?([0-9,]+\.?\d{0,2})\s*USD',  # "Amount due $12.34 USD"
-        r'\$\s*([0-9,]+\.?\d{0,2})',          # "$12.34" (USD for international invoices)
-        r'([0-9,]+\.?\d{0,2})\s*USD',         # "12.34 USD"
-        r'total[:\s]*\$?\s*([0-9,]+\.?\d{0,2})',  # "TOTAL: $12.34"
-        r'amount[:\s]*\$?\s*([0-9,]+\.?\d{0,2})',  # "AMOUNT: $12.34"
-        r'^([0-9]{1,3}(?:,[0-9]{3})*\.?[0-9]{0,2})$',  # Standalone amounts like "7,000.00" on their own line
-        r'\n([0-9]{1,3}(?:,[0-9]{3})*\.?[0-9]{0,2})\n',  # Amount surrounded by newlines
-    ]
+    # The context windows below are sliced by offsets into text, so text_lower is only
+    # usable when lowercasing kept the length (it doesn't for e.g. 'İ')
+    if text_lower is None:
+        text_lower = text.lower()
+    if len(text_lower) != len(text):
+        text_lower = None
     
     amounts = []
     
-    for pattern in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE)
-        for match in matches:
+    for pattern in candidates(_AMOUNT_RES, hits):
+        for match in pattern.finditer(text):
             try:
-                amount_str = match.group(1).replace(',', '')  # Remove commas
-                amount = float(amount_str)
+                amount = parse_amount(match.group(1))
                 
                 # Filter out unreasonably large amounts (likely transaction IDs)
                 if amount > 1000000:  # More than 1 million naira is likely an ID
@@ -192,118 +301,96 @@ def extract_amount(text):
         size_score = min(amt, 1000)  # Cap size influence
         
         # Bonus for amounts that are likely "final" amounts
-        text_around = text[max(0, int(pos * len(text)) - 50):int(pos * len(text)) + 50].lower()
-        if any(keyword in text_around for keyword in ['total', 'due', 'amount due', 'pay']):
+        start, end = max(0, int(pos * len(text)) - 50), int(pos * len(text)) + 50
+        text_around = text_lower[start:end] if text_lower is not None else text[start:end].lower()
+        if contains_any(_AMOUNT_CONTEXT_AUTOMATON, text_around):
             position_score += 50  # Bonus for final amount context
         
         final_score = position_score + size_score
         final_amounts.append((amt, pos, final_score))
     
-    # Sort by final score (highest first)
-    final_amounts.sort(key=lambda x: x[2], reverse=True)
-    
-    # Return the amount with the highest final score
-    return final_amounts[0][0]
+    # Return the amount with the highest final score (the first one on ties, as the
+    # stable sort this replaced did)
+    return max(final_amounts, key=lambda x: x[2])[0]
 
-def extract_date(text):
+def extract_date(text, hits=None):
     """Extract transaction date - Updated for Nigerian formats and international invoices"""
-    # Nigerian and international date patterns
-    patterns = [
-        r'(Nov\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}\s+\d{1,2}:\d{2}:\d{2})',  # "Nov 7th, 2025 17:53:25"
-        r'(Nov\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})',  # "Nov 7th, 2025"
-        r'(October\s+\d{1,2},?\s+\d{4})',  # "October 14, 2025"
-        r'(November\s+\d{1,2},?\s+\d{4})',  # "November 3, 2025"
-        r'((?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4})',  # Full month names
-        r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',  # 12/31/2024, 12-31-24
-        r'(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4})',  # 31 Dec 2024
-        r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{2,4})',  # December 31, 2024
-        r'(\d{4}-\d{1,2}-\d{1,2})',  # 2024-12-31 (ISO format)
-        r'(\d{2}/\d{2}/\d{4})',  # DD/MM/YYYY
-    ]
     
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in candidates(_DATE_RES, hits):
+        match = pattern.search(text)
         if match:
             date_str = match.group(1) if len(match.groups()) > 0 else match.group(0)
             return date_str.strip()
     
     return None
 
-def classify_category(vendor, text):
+def classify_category(vendor, text, text_lower=None):
     """Classify receipt category - Updated for Nigerian businesses and international services"""
-    content = ((vendor or '') + ' ' + text).lower()
-    
-    categories = {
-        'financial': ['opay', 'bank', 'transfer', 'payment', 'transaction', 'mobile money', 'fintech'],
-        'electronics': ['electro', 'galactica', 'electronics', 'computer', 'tech', 'gadget'],
-        'technology': ['hosting', 'domain', 'server', 'cloud', 'software', 'saas', 'railway', 'vercel', 'netlify', 'aws', 'invoice'],
-        'business': ['company ltd', 'limited', 'corporation', 'enterprise', 'services', 'consultant'],
-        'groceries': ['grocery', 'supermarket', 'food', 'market', 'shoprite', 'spar', 'provision'],
-        'restaurant': ['restaurant', 'cafe', 'pizza', 'dining', 'bar', 'grill', 'kitchen', 'eatery'],
-        'fuel': ['gas', 'fuel', 'petrol', 'filling station', 'total', 'mobil', 'oando'],
-        'retail': ['store', 'shop', 'mall', 'boutique', 'clothing', 'fashion'],
-        'pharmacy': ['pharmacy', 'medical', 'drug', 'health', 'hospital', 'clinic'],
-        'transportation': ['uber', 'bolt', 'taxi', 'bus', 'transport', 'travel'],
-        'utilities': ['electric', 'water', 'nepa', 'internet', 'phone', 'utility', 'telecom', 'mtn', 'airtel'],
-        'education': ['school', 'university', 'education', 'training', 'course'],
-    }
+    if text_lower is None:
+        text_lower = text.lower()
+    content = (vendor or '').lower() + ' ' + text_lower
     
-    for category, keywords in categories.items():
-        if any(keyword in content for keyword in keywords):
-            return category
-    
-    return 'other'
+    # One pass over content for every category keyword, earlier categories win
+    return count_category(first_label(_CATEGORY_AUTOMATON, _CATEGORY_NAMES, content) or 'other')
+
+# Line items as one structured array (a column per field) rather than a dict per item.
+# float64 for prices - float32 can't hold amounts like 123456.78 exactly.
+LINE_ITEM_DTYPE = np.dtype([
+    ('name', 'O'),
+    ('quantity', 'i8'),
+    ('unit_price', 'f8'),
+    ('total_price', 'f8'),
+])
+_MAX_QUANTITY = np.iinfo(LINE_ITEM_DTYPE['quantity']).max
 
-def extract_line_items(text):
-    """Extract line items from receipt text"""
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
+def line_items_as_dicts(line_items):
+    """Convert a LINE_ITEM_DTYPE array to the list-of-dicts form used in API results"""
+    names = line_items.dtype.names
+    return [dict(zip(names, row)) for row in line_items.tolist()]
+
+def extract_line_items(text, lines=None, lines_lower=None, as_array=False):
+    """Extract line items from receipt text as a list of dicts (a LINE_ITEM_DTYPE array with as_array=True)"""
+    if lines is None:
+        lines = split_lines(text)
+    if lines_lower is None:
+        lines_lower = [line.lower() for line in lines]
     line_items = []
     
-    # Patterns for line items (name, quantity, price)
-    patterns = [
-        # Pattern: "Item Name    Qty    Price" or "Item Name    Pcs    2    800.00"
-        r'^([A-Za-z][A-Za-z\s\.,&-]+?)\s+(Pcs?|REGULAR)\s+(\d+)\s+([0-9,]+\.?\d{0,2})$',
-        # Pattern: "Item Name    Price" (assume quantity = 1)
-        r'^([A-Za-z][A-Za-z\s\.,&-]+?)\s+([0-9,]+\.?\d{0,2})$',
-        # Pattern with different separators
-        r'^([A-Za-z][A-Za-z\s\.,&-]+?)\s+(?:Pcs?|REGULAR|x)?\s*(\d+)?\s*x?\s*([0-9,]+\.?\d{0,2})$'
-    ]
-
-    for line in lines:
+    for line, line_lower in zip(lines, lines_lower):
         # Skip header lines and totals
-        if any(skip in line.lower() for skip in ['item name', 'subtotal', 'total', 'discount', 'settled', 'thank you', 'receipt', '====']):
+        if contains_any(_LINE_ITEM_SKIP_AUTOMATON, line_lower):
             continue
 
         # Skip very short lines or lines without numbers
         if len(line) < 5 or not any(c.isdigit() for c in line):
             continue
 
-        for pattern in patterns:
-            match = re.match(pattern, line.strip(), re.IGNORECASE)
+        for pattern in _LINE_ITEM_RES:
+            match = pattern.match(line.strip())
             if match:
                 groups = match.groups()
 
                 if len(groups) == 4:  # Full pattern with unit type
                     name, unit_type, qty, price = groups
                     quantity = int(qty)
-                    total_price = float(price.replace(',', ''))
+                    total_price = parse_amount(price)
                     unit_price = total_price / quantity if quantity > 0 else total_price
                 elif len(groups) == 3:  # Flexible pattern  
                     name, qty_or_price, price_or_empty = groups
                     if qty_or_price and qty_or_price.isdigit():
                         # qty_or_price is quantity
                         quantity = int(qty_or_price)
-                        total_price = float(price_or_empty.replace(',', ''))
+                        total_price = parse_amount(price_or_empty)
                         unit_price = total_price / quantity if quantity > 0 else total_price
                     else:
                         # qty_or_price is actually price
                         quantity = 1
-                        total_price = float(qty_or_price.replace(',', ''))
+                        total_price = parse_amount(qty_or_price)
                         unit_price = total_price
                 elif len(groups) == 2:  # Simple name + price
                     name, price = groups
                     quantity = 1
-                    total_price = float(price.replace(',', ''))
+                    total_price = parse_amount(price)
                     unit_price = total_price
                 else:
                     continue
@@ -315,15 +402,17 @@ def extract_line_items(text):
                 if total_price < 10:
                     continue
                 
-                line_items.append({
-                    'name': name,
-                    'quantity': quantity,
-                    'unit_price': unit_price,
-                    'total_price': total_price
-                })
+                # A "quantity" too big for the column is an ID or barcode, not an item
+                if quantity > _MAX_QUANTITY:
+                    continue
+                
+                line_items.append((name, quantity, unit_price, total_price))
                 break  # Found a match, move to next line
     
-    return line_items
+    if as_array:
+        return np.array(line_items, dtype=LINE_ITEM_DTYPE)
+    names = LINE_ITEM_DTYPE.names
+    return [dict(zip(names, item)) for item in line_items]
 
 def process_receipt(image_path):
     """Complete receipt processing pipeline"""
@@ -344,11 +433,16 @@ def process_receipt(image_path):
             }
         
         # Extract individual fields
-        vendor = extract_vendor(text)
-        amount = extract_amount(text)
-        date = extract_date(text)
-        category = classify_category(vendor, text)
-        line_items = extract_line_items(text)
+        # Lowercase and split the text once for all extractors
+        text_lower = text.lower()
+        lines = split_lines(text)
+        lines_lower = [line.lower() for line in lines]
+        hits = _scan_patterns(text)
+        vendor = extract_vendor(text, hits, text_lower, lines, lines_lower)
+        amount = extract_amount(text, hits, text_lower)
+        date = extract_date(text, hits)
+        category = classify_category(vendor, text, text_lower)
+        line_items = extract_line_items(text, lines, lines_lower)
 
         return {
             'vendor': vendor,
@@ -371,4 +465,8 @@ def process_receipt(image_path):
             'raw_text': '',
             'success': False,
             'error': str(e)
-        }
\ No newline at end of file
+        }
+
+def process_receipts(paths, workers=None):
+    """Process receipt files in the shared worker processes (see ocr_utils.process_in_workers); results keep the order of paths"""
+    return process_in_workers(process_receipt, paths, workers)
@@ -0,0 +1,223 @@
+r"""Helpers shared by simple_ocr and ocr_processor; each module keeps its own pattern tables.
+
+Both modules' pattern tables follow the same rules:
+- Amount/date patterns stay separate rather than fused into one alternation:
+  each compiled pattern gets its own literal-prefix scan and extract_date stops
+  at the first pattern that hits, so a fused single pass measured slower.
+- Patterns that open with a run of letters (company names) or digits (amounts)
+  only start at the beginning of one, via a lookbehind: a start further in always
+  loses to the earlier one, and each retry rescans the run.
+- Patterns are compiled with the `regex` package (VERSION1), not stdlib `re`. On
+  printable ASCII text they match the same, but some character classes differ:
+  `\s` doesn't match the \x1c-\x1f separator controls, with IGNORECASE `[A-Z]`
+  doesn't match 'İ' (U+0130) and `[a-z]` doesn't match 'ı' (U+0131), and
+  `\w`/`\d` follow regex's Unicode tables (e.g. combining marks count as `\w`,
+  superscript digits don't). So 'ACME\x1fFOODS LTD' now gives the vendor
+  'FOODS LTD', where `re` gave the whole string.
+"""
+import multiprocessing
+import os
+import threading
+from collections import Counter
+import regex as re
+try:
+    import ahocorasick
+except ImportError:  # keyword checks then fall back to plain substring tests
+    ahocorasick = None
+try:
+    import hyperscan
+except ImportError:  # Hyperscan wheels are x86-64 only; extraction then runs every pattern
+    hyperscan = None
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Multi-threaded Tesseract only adds OpenMP contention on single-page receipts
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# Receipts are one or two pages; only those are parsed, and extraction stops
+# once a page brings the text past PDF_TEXT_TARGET_CHARS
+PDF_MAX_PAGES = 2
+PDF_PAGES = list(range(1, PDF_MAX_PAGES + 1))
+PDF_TEXT_TARGET_CHARS = 2048
+
+_FILE_TYPES = {
+    '.pdf': 'pdf',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.png': 'image',
+    '.tiff': 'image',
+    '.bmp': 'image',
+}
+
+def get_file_type(file_path):
+    """Determine file type"""
+    return _FILE_TYPES.get(os.path.splitext(file_path)[1].lower(), 'unknown')
+
+def pdfplumber_text(file_path):
+    """Page texts from the first PDF_MAX_PAGES pages with pdfplumber, stopping early
+    once past PDF_TEXT_TARGET_CHARS; returns (parts, total characters)"""
+    import pdfplumber
+
+    parts = []
+    total = 0
+    with pdfplumber.open(file_path, pages=PDF_PAGES) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if page_text:
+                parts.append(page_text)
+                total += len(page_text)
+                if total > PDF_TEXT_TARGET_CHARS:
+                    break
+    return parts, total
+
+def _build_prefilter(patterns):
+    # Prefilter mode accepts lookbehinds and possessive quantifiers by matching a
+    # superset; a false positive only means the regex pattern runs anyway
+    base_flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+                  | hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_PREFILTER)
+    expressions = [p.pattern.encode() for p in patterns]
+    flags = [base_flags | (hyperscan.HS_FLAG_MULTILINE if p.flags & re.MULTILINE else 0)
+             for p in patterns]
+    database = hyperscan.Database()
+    database.compile(expressions=expressions, ids=list(range(len(patterns))),
+                     elements=len(patterns), flags=flags)
+    return database
+
+# Hyperscan has no capture groups, so it can't pull out the fields itself. Instead
+# one scan over the text records which field patterns occur at all, and the
+# extractors only run the regex patterns that can actually match.
+def build_pattern_scanner(patterns):
+    """Return scan(text): the set of patterns that match somewhere in text (None without Hyperscan)"""
+    if hyperscan is None:
+        return lambda text: None
+
+    # Compiling the database takes a few hundred ms, so it happens on the first scan
+    # rather than at import
+    database = None
+    lock = threading.Lock()
+    # A scratch space serves one scan at a time, so each thread gets its own
+    local = threading.local()
+
+    def on_match(pattern_id, start, end, flags, hits):
+        hits.add(patterns[pattern_id])
+
+    def scan(text):
+        nonlocal database
+        if database is None:
+            with lock:
+                if database is None:
+                    database = _build_prefilter(patterns)
+        scratch = getattr(local, 'scratch', None)
+        if scratch is None:
+            scratch = local.scratch = hyperscan.Scratch(database)
+        hits = set()
+        database.scan(text.encode(), match_event_handler=on_match, context=hits, scratch=scratch)
+        return hits
+
+    return scan
+
+def candidates(patterns, hits):
+    return patterns if hits is None else [p for p in patterns if p in hits]
+
+def build_automaton(keywords_by_label):
+    """Aho-Corasick automaton over all keywords; each keyword maps to the index
+    of the first label (in dict order) that lists it"""
+    if ahocorasick is None:
+        # Reverse keyword -> label index list in label order, so the first
+        # keyword found belongs to the first label that matches
+        return [(keyword, index) for index, keywords in enumerate(keywords_by_label.values())
+                for keyword in keywords]
+    automaton = ahocorasick.Automaton()
+    for index, keywords in enumerate(keywords_by_label.values()):
+        for keyword in keywords:
+            automaton.add_word(keyword, min(index, automaton.get(keyword, index)))
+    automaton.make_automaton()
+    return automaton
+
+def first_label(automaton, labels, content):
+    """Label of the earliest entry with a keyword in content (one scan), or None"""
+    if ahocorasick is None:
+        for keyword, index in automaton:
+            if keyword in content:
+                return labels[index]
+        return None
+    best = len(labels)
+    for _, index in automaton.iter(content):
+        if index < best:
+            best = index
+            if best == 0:
+                break
+    return labels[best] if best < len(labels) else None
+
+def contains_any(automaton, content):
+    if ahocorasick is None:
+        return any(keyword in content for keyword, _ in automaton)
+    return next(automaton.iter(content), None) is not None
+
+# Dev-only: with OCR_CATEGORY_STATS=true, classify_category tallies its results here
+# so keyword lists can be reordered from real receipt frequencies. The category
+# order itself decides which category wins, so it isn't reordered for speed.
+CATEGORY_STATS = Counter() if os.getenv("OCR_CATEGORY_STATS", "false").lower() == "true" else None
+
+def count_category(category):
+    if CATEGORY_STATS is not None:
+        CATEGORY_STATS[category] += 1
+    return category
+
+def split_lines(text):
+    """Stripped, non-empty lines of text (one strip per line)"""
+    return [stripped for line in text.split('\n') if (stripped := line.strip())]
+
+# Amounts stay on float() + str.replace: both run in C, and replace returns the
+# same string when there's no comma. A per-character digit-accumulator parser
+# measured ~3x slower in CPython.
+def parse_amount(amount_str):
+    """Parse a matched amount like '7,000.00' (raises ValueError if it has no digits)"""
+    return float(amount_str.replace(',', ''))
+
+def _init_worker():
+    # One single-threaded Tesseract per worker process scales better than
+    # several processes each spinning up OpenMP threads
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+# Worker processes for batch OCR, created on first use and kept for the life of the
+# server so each batch doesn't pay for process start-up and library imports again
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count()
+_WORKER_POOL = None
+_WORKER_POOL_LOCK = threading.Lock()
+
+def _get_worker_pool():
+    global _WORKER_POOL
+    with _WORKER_POOL_LOCK:
+        if _WORKER_POOL is None:
+            # spawn, not fork: the server process has threads (and their locks) running
+            _WORKER_POOL = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=_init_worker)
+        return _WORKER_POOL
+
+def shutdown_workers():
+    """Stop the shared worker pool (called when the server shuts down)"""
+    global _WORKER_POOL
+    with _WORKER_POOL_LOCK:
+        if _WORKER_POOL is not None:
+            _WORKER_POOL.shutdown(cancel_futures=True)
+            _WORKER_POOL = None
+
+def process_in_workers(process_receipt, paths, workers=None):
+    """Run process_receipt over paths in parallel worker processes; results keep the order of paths.
+
+    Uses the shared long-lived pool, or a one-off pool of `workers` processes if given.
+    """
+    global _WORKER_POOL
+    if workers is not None:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            return list(executor.map(process_receipt, paths, chunksize=4))
+    pool = _get_worker_pool()
+    try:
+        return list(pool.map(process_receipt, paths))
+    except BrokenProcessPool:
+        # A worker died (e.g. Tesseract crashed); start a fresh pool next time
+        with _WORKER_POOL_LOCK:
+            if _WORKER_POOL is pool:
+                _WORKER_POOL = None
+        raise
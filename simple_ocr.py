@@ -1,18 +1,100 @@
-import re
-import pdfplumber
-from pathlib import Path
+import regex as re
 from datetime import datetime
+from ocr_utils import (get_file_type, pdfplumber_text,
+                       build_pattern_scanner, candidates, build_automaton, first_label, contains_any,
+                       count_category, split_lines, parse_amount, process_in_workers)
+
+# Regexes are compiled once at import instead of on every call (`regex` package, VERSION1;
+# its Unicode classes differ slightly from `re`, see ocr_utils)
+_FLAGS = re.IGNORECASE | re.VERSION1
+
+# Recipient company patterns
+_RECIPIENT_RES = tuple(re.compile(p, _FLAGS) for p in (
+    r'recipient\s+details\s+([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|PLC))',  # Companies
+    r'(?<![A-Z])([A-Z][A-Za-z\s&.-]+(?:STORES?|SHOPPING|COMMUNICATIONS?|BANK|NIGERIA)(?:\s+(?:LIMITED|LTD|PLC))?)',  # Nigerian companies
+))
+
+# Look for general company patterns
+_VENDOR_RES = tuple(re.compile(p, _FLAGS) for p in (
+    r'(?<![A-Z])([A-Z][A-Za-z\s&.-]+(?:Corporation|Corp|Ltd|Limited|Inc|Company|LLC|PLC))',
+    r'(Railway\s+Corporation)',
+    r'([A-Z][A-Z\s]{2,20}(?:LTD|LIMITED|INC|COMPANY|CORP|PLC))',
+))
+
+# Patterns for different currency formats
+_AMOUNT_RES = tuple(re.compile(p, _FLAGS) for p in (
+    # USD patterns (for Railway invoices) - note: no need to escape $ in raw strings
+    r'Amount\s+due\s+\$([0-9,]+\.?\d{0,2})\s*USD',  # "Amount due $5.00 USD"
+    r'\$([0-9,]+\.?\d{0,2})\s*USD\s+due',           # "$5.00 USD due"
+    r'Total\s+\$([0-9,]+\.?\d{0,2})',               # "Total $5.00"
+    r'Amount\s+due\s+\$([0-9,]+\.?\d{0,2})',        # "Amount due $5.00"
+    
+    # Naira patterns (for OPay receipts)
+    r'₦\s*([0-9,]+\.?\d{0,2})',                     # "₦7,000.00"
+    r'#([0-9,]+\.?\d{0,2})',                        # "#7,000.00" (OPay format)
+    r'#([0-9,]+)',                                  # "#250000" (no decimal)
+    r'(?<![0-9,])([0-9,]+\.?\d{0,2})\s*naira',      # "7,000.00 naira"
+    
+    # Generic patterns
+    r'total[:\s]*\$?([0-9,]+\.?\d{0,2})',           # "TOTAL: $5.00" or "TOTAL: 7000"
+    r'amount[:\s]*\$?([0-9,]+\.?\d{0,2})',          # "AMOUNT: $5.00"
+))
+
+# Date patterns
+_DATE_RES = tuple(re.compile(p, _FLAGS) for p in (
+    # Full month names
+    r'((?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4})',
+    # Short month names with time (OPay format) - more flexible
+    r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)-?\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}\s+\d{1,2}:\d{2}:\d{2})',
+    # Short month names with ordinal indicators
+    r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2}(?:st|nd|rd|th),?\s+\d{4})',
+    # Short month names  
+    r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s*-?\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})',
+    # Standard formats
+    r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
+    r'(\d{4}-\d{1,2}-\d{1,2})',
+))
+
+# Field patterns checked by the Hyperscan prefilter before extraction
+_PREFILTER_RES = _RECIPIENT_RES + _VENDOR_RES + _AMOUNT_RES + _DATE_RES
+_scan_patterns = build_pattern_scanner(_PREFILTER_RES)
+
+# Vendor-specific keywords, checked first (more accurate)
+VENDOR_CATEGORY_KEYWORDS = {
+    'technology': ['railway', 'hosting', 'domain', 'server', 'cloud', 'software', 'railway corporation'],
+    'electronics': ['electro', 'galactica', 'electronics', 'computer', 'tech'],
+    'groceries': ['shoprite', 'grocery', 'supermarket', 'food', 'market', 'stores'],
+    'retail': ['konga', 'jumia', 'amazon', 'shop', 'mall', 'boutique', 'shopping', 'online shopping'],
+    'utilities': ['mtn', 'airtel', 'glo', 'communications', 'telecom', 'electric', 'water', 'internet', 'phone'],
+    'financial': ['bank', 'first bank', 'access bank', 'gtbank', 'zenith bank'],
+    'restaurant': ['restaurant', 'cafe', 'dining', 'bar', 'kfc', 'dominos'],
+    'fuel': ['gas', 'fuel', 'petrol', 'filling station', 'mobil', 'total', 'oando'],
+    'transportation': ['uber', 'bolt', 'taxi', 'transport', 'airline'],
+}
+
+# Full-text keywords, used when the vendor doesn't match (kept narrow to avoid false positives)
+GENERAL_CATEGORY_KEYWORDS = {
+    'financial': ['opay', 'mobile money', 'wallet', 'payment app'],
+    'personal': ['opay | 7', 'opay | 8', 'opay | 9'],  # Personal phone numbers in OPay format
+    'business': ['company ltd', 'limited', 'corporation', 'enterprise'],
+}
+
+_VENDOR_CATEGORY_NAMES = list(VENDOR_CATEGORY_KEYWORDS)
+_VENDOR_CATEGORY_AUTOMATON = build_automaton(VENDOR_CATEGORY_KEYWORDS)
+_GENERAL_CATEGORY_NAMES = list(GENERAL_CATEGORY_KEYWORDS)
+_GENERAL_CATEGORY_AUTOMATON = build_automaton(GENERAL_CATEGORY_KEYWORDS)
+
+# Vendor names containing these are companies, not people
+_COMPANY_INDICATOR_AUTOMATON = build_automaton({'company': ['ltd', 'limited', 'inc', 'corp', 'company', 'plc', 'stores', 'bank', 'communications']})
+
+# Lines to skip when looking for a vendor name
+_VENDOR_SKIP_AUTOMATON = build_automaton({'skip': ['invoice', 'receipt', 'transaction', 'date', 'bill to', '@']})
 
 def extract_text_from_pdf(file_path):
     """Extract text from PDF using pdfplumber"""
     try:
-        text = ""
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        return text.strip()
+        parts, _ = pdfplumber_text(file_path)
+        return "\n".join(parts).strip()
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return ""
@@ -21,11 +103,10 @@ def extract_text_from_image(file_path):
     """For images, we'll need tesseract - install it if available, otherwise return empty"""
     try:
         import pytesseract
-        from PIL import Image
         
-        # Basic image processing and OCR
-        image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
+        # Hand tesseract the file path directly - passing a PIL image makes
+        # pytesseract re-encode it to a temp file first
+        text = pytesseract.image_to_string(str(file_path), config='--oem 1')
         return text
     except ImportError:
         print("Warning: pytesseract not available for image processing. Install it with: pip install pytesseract")
@@ -34,24 +115,16 @@ def extract_text_from_image(file_path):
         print(f"Error extracting text from image: {e}")
         return ""
 
-def get_file_type(file_path):
-    """Determine file type"""
-    file_path = Path(file_path)
-    extension = file_path.suffix.lower()
-    
-    if extension == '.pdf':
-        return 'pdf'
-    elif extension in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp']:
-        return 'image'
-    else:
-        return 'unknown'
-
-def extract_vendor(text):
+def extract_vendor(text, hits=None, text_lower=None, lines=None, lines_lower=None):
     """Extract vendor name with improved patterns"""
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if text_lower is None:
+        text_lower = text.lower()
+    if lines is None:
+        lines = split_lines(text)
+    if lines_lower is None:
+        lines_lower = [line.lower() for line in lines]
     
     # Check for specific known vendors first
-    text_lower = text.lower()
     if 'railway corporation' in text_lower:
         return 'Railway Corporation'
     if 'electro galactica' in text_lower:
@@ -59,9 +132,8 @@ def extract_vendor(text):
     
     # For OPay receipts, look for recipient details
     # Use line-by-line approach for better accuracy
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    for line in lines:
-        if 'recipient details' in line.lower():
+    for line, line_lower in zip(lines, lines_lower):
+        if 'recipient details' in line_lower:
             # Extract everything after 'Recipient Details'
             parts = line.split('Details', 1)
             if len(parts) > 1:
@@ -70,14 +142,8 @@ def extract_vendor(text):
                     return vendor
     
     # Fallback to pattern matching for companies
-    recipient_patterns = [
-        r'recipient\s+details\s+([A-Z][A-Z\s&.-]+(?:LTD|LIMITED|INC|COMPANY|CORP|PLC))',  # Companies
-        r'([A-Z][A-Za-z\s&.-]+(?:STORES?|SHOPPING|COMMUNICATIONS?|BANK|NIGERIA)(?:\s+(?:LIMITED|LTD|PLC))?)',  # Nigerian companies
-    ]
-    
-    for pattern in recipient_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
+    for pattern in candidates(_RECIPIENT_RES, hits):
+        for match in pattern.findall(text):
             vendor = match.strip()
             if len(vendor) > 3:
                 return vendor
@@ -87,22 +153,15 @@ def extract_vendor(text):
         return 'OPay'
     
     # Look for general company patterns
-    vendor_patterns = [
-        r'([A-Z][A-Za-z\s&.-]+(?:Corporation|Corp|Ltd|Limited|Inc|Company|LLC|PLC))',
-        r'(Railway\s+Corporation)',
-        r'([A-Z][A-Z\s]{2,20}(?:LTD|LIMITED|INC|COMPANY|CORP|PLC))',
-    ]
-    
-    for pattern in vendor_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
+    for pattern in candidates(_VENDOR_RES, hits):
+        for match in pattern.findall(text):
             vendor = match.strip()
             if len(vendor) > 3 and 'bank' not in vendor.lower():
                 return vendor
     
     # Look for lines that appear to be company names
-    for line in lines[:5]:  # Check first 5 lines
-        if any(skip in line.lower() for skip in ['invoice', 'receipt', 'transaction', 'date', 'bill to', '@']):
+    for line, line_lower in zip(lines[:5], lines_lower):  # Check first 5 lines
+        if contains_any(_VENDOR_SKIP_AUTOMATON, line_lower):
             continue
         
         # If line has mostly uppercase and is reasonable length
@@ -113,35 +172,15 @@ def extract_vendor(text):
     
     return None
 
-def extract_amount(text):
+def extract_amount(text, hits=None):
     """Extract amount with improved patterns for both USD and Naira"""
-    # Patterns for different currency formats
-    patterns = [
-        # USD patterns (for Railway invoices) - note: no need to escape $ in raw strings
-        r'Amount\s+due\s+\$([0-9,]+\.?\d{0,2})\s*USD',  # "Amount due $5.00 USD"
-        r'\$([0-9,]+\.?\d{0,2})\s*USD\s+due',           # "$5.00 USD due"
-        r'Total\s+\$([0-9,]+\.?\d{0,2})',               # "Total $5.00"
-        r'Amount\s+due\s+\$([0-9,]+\.?\d{0,2})',        # "Amount due $5.00"
-        
-        # Naira patterns (for OPay receipts)
-        r'₦\s*([0-9,]+\.?\d{0,2})',                     # "₦7,000.00"
-        r'#([0-9,]+\.?\d{0,2})',                        # "#7,000.00" (OPay format)
-        r'#([0-9,]+)',                                  # "#250000" (no decimal)
-        r'([0-9,]+\.?\d{0,2})\s*naira',                 # "7,000.00 naira"
-        
-        # Generic patterns
-        r'total[:\s]*\$?([0-9,]+\.?\d{0,2})',           # "TOTAL: $5.00" or "TOTAL: 7000"
-        r'amount[:\s]*\$?([0-9,]+\.?\d{0,2})',          # "AMOUNT: $5.00"
-    ]
     
     amounts_found = []
     
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
+    for pattern in candidates(_AMOUNT_RES, hits):
+        for match in pattern.findall(text):
             try:
-                amount_str = match.replace(',', '')  # Remove commas
-                amount = float(amount_str)
+                amount = parse_amount(match)
                 
                 # Filter out unreasonably large amounts (likely IDs)
                 if 0.01 <= amount <= 10000000:  # Reasonable range (up to 10 million naira/dollars)
@@ -155,72 +194,35 @@ def extract_amount(text):
     # Return the largest amount found (usually the total)
     return max(amounts_found)
 
-def extract_date(text):
+def extract_date(text, hits=None):
     """Extract date with improved patterns"""
-    date_patterns = [
-        # Full month names
-        r'((?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4})',
-        # Short month names with time (OPay format) - more flexible
-        r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)-?\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4}\s+\d{1,2}:\d{2}:\d{2})',
-        # Short month names with ordinal indicators
-        r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2}(?:st|nd|rd|th),?\s+\d{4})',
-        # Short month names  
-        r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s*-?\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})',
-        # Standard formats
-        r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-        r'(\d{4}-\d{1,2}-\d{1,2})',
-    ]
     
-    for pattern in date_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in candidates(_DATE_RES, hits):
+        match = pattern.search(text)
         if match:
             return match.group(1).strip()
     
     return None
 
-def classify_category(vendor, text):
+def classify_category(vendor, text, text_lower=None):
     """Classify receipt category"""
     vendor_lower = (vendor or '').lower()
-    text_lower = text.lower()
-    
-    # Check vendor-specific patterns first (more accurate)
-    vendor_categories = {
-        'technology': ['railway', 'hosting', 'domain', 'server', 'cloud', 'software', 'railway corporation'],
-        'electronics': ['electro', 'galactica', 'electronics', 'computer', 'tech'],
-        'groceries': ['shoprite', 'grocery', 'supermarket', 'food', 'market', 'stores'],
-        'retail': ['konga', 'jumia', 'amazon', 'shop', 'mall', 'boutique', 'shopping', 'online shopping'],
-        'utilities': ['mtn', 'airtel', 'glo', 'communications', 'telecom', 'electric', 'water', 'internet', 'phone'],
-        'financial': ['bank', 'first bank', 'access bank', 'gtbank', 'zenith bank'],
-        'restaurant': ['restaurant', 'cafe', 'dining', 'bar', 'kfc', 'dominos'],
-        'fuel': ['gas', 'fuel', 'petrol', 'filling station', 'mobil', 'total', 'oando'],
-        'transportation': ['uber', 'bolt', 'taxi', 'transport', 'airline'],
-    }
+    if text_lower is None:
+        text_lower = text.lower()
     
     # First check vendor name for specific categorization
-    for category, keywords in vendor_categories.items():
-        if any(keyword in vendor_lower for keyword in keywords):
-            return category
-    
-    # If vendor doesn't match, check full text but avoid false positives
-    general_categories = {
-        'financial': ['opay', 'mobile money', 'wallet', 'payment app'],
-        'personal': ['opay | 7', 'opay | 8', 'opay | 9'],  # Personal phone numbers in OPay format
-        'business': ['company ltd', 'limited', 'corporation', 'enterprise'],
-    }
+    category = first_label(_VENDOR_CATEGORY_AUTOMATON, _VENDOR_CATEGORY_NAMES, vendor_lower)
+    if category:
+        return count_category(category)
     
     # Check if it's a personal transfer (individual recipient)
     if vendor and len(vendor.split()) >= 2:  # Full name format
         # Check if vendor looks like a person's name (no company indicators)
-        company_indicators = ['ltd', 'limited', 'inc', 'corp', 'company', 'plc', 'stores', 'bank', 'communications']
-        if not any(indicator in vendor.lower() for indicator in company_indicators):
-            return 'personal'
+        if not contains_any(_COMPANY_INDICATOR_AUTOMATON, vendor_lower):
+            return count_category('personal')
     
-    for category, keywords in general_categories.items():
-        if any(keyword in text_lower for keyword in keywords):
-            # Only if it's not already categorized by vendor
-            return category
-    
-    return 'other'
+    # Only if it's not already categorized by vendor
+    return count_category(first_label(_GENERAL_CATEGORY_AUTOMATON, _GENERAL_CATEGORY_NAMES, text_lower) or 'other')
 
 def process_receipt(file_path):
     """Main receipt processing function"""
@@ -256,10 +258,15 @@ def process_receipt(file_path):
             }
         
         # Extract information
-        vendor = extract_vendor(text)
-        amount = extract_amount(text)
-        date = extract_date(text)
-        category = classify_category(vendor, text)
+        # Lowercase and split the text once for all extractors
+        text_lower = text.lower()
+        lines = split_lines(text)
+        lines_lower = [line.lower() for line in lines]
+        hits = _scan_patterns(text)
+        vendor = extract_vendor(text, hits, text_lower, lines, lines_lower)
+        amount = extract_amount(text, hits)
+        date = extract_date(text, hits)
+        category = classify_category(vendor, text, text_lower)
         
         return {
             'vendor': vendor,
@@ -282,4 +289,8 @@ def process_receipt(file_path):
             'raw_text': '',
             'success': False,
             'error': str(e)
-        }
\ No newline at end of file
+        }
+
+def process_receipts(paths, workers=None):
+    """Process receipt files in the shared worker processes (see ocr_utils.process_in_workers); results keep the order of paths"""
+    return process_in_workers(process_receipt, paths, workers)